@@ -1,29 +1,193 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 import polars as pl
+import json
+import operator
 import os
-from functools import lru_cache
+import threading
+from datetime import date, datetime
+from functools import lru_cache, reduce
 
 app = Flask(__name__)
 CORS(app)  # Allow requests from GitHub Pages
 
-# Path to your TSV file - update this to match your local path
-# Line 11 - Change to:
-DATA_PATH = os.environ.get('DATA_PATH', r'C:\personal_projects\chadvo-ds-website\projects\map_viz\data\redfin\raw\redfin_zip_all_states.tsv')
+# Path to the Redfin data - a directory of Hive-partitioned Parquet written by
+# convert_to_parquet.py (STATE_CODE=XX/data.parquet), or the raw TSV file.
+# If the Parquet directory has not been generated yet, the raw TSV is used.
+# An s3:// URL reads the same Parquet layout from Cloudflare R2 instead.
+DATA_PATH = os.environ.get('DATA_PATH', r'C:\personal_projects\chadvo-ds-website\projects\map_viz\data\redfin\redfin_parquet')
+TSV_PATH = os.environ.get('TSV_PATH', r'C:\personal_projects\chadvo-ds-website\projects\map_viz\data\redfin\raw\redfin_zip_all_states.tsv')
+
+# Always read as pl.Date, so date filters compare Date to Date without a cast
+DATE_COLUMNS = {'PERIOD_BEGIN': pl.Date, 'PERIOD_END': pl.Date}
+
+# Precomputed geography aggregates written by
+# projects/map_viz/src/aggregate_redfin_to_geographies.py
+AGGREGATED_DIR = os.environ.get('AGGREGATED_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'map_viz', 'data', 'redfin', 'processed'))
+AGGREGATED_FILES = {
+    'state': 'redfin_state_aggregated.json',
+    'county': 'redfin_county_aggregated.json'
+}
+
+# Largest result /api/aggregate will return
+MAX_AGGREGATE_ROWS = 5000
+
+# Rows serialized per chunk of a streamed /api/data or /api/aggregate response
+RESPONSE_SLICE_ROWS = 1000
+
+def r2_storage_options():
+    """Credentials for reading DATA_PATH from R2, taken from the environment"""
+    return {
+        'aws_access_key_id': os.environ['R2_ACCESS_KEY_ID'],
+        'aws_secret_access_key': os.environ['R2_SECRET_ACCESS_KEY'],
+        'aws_endpoint_url': os.environ['R2_ENDPOINT_URL'],
+        'aws_region': 'auto'
+    }
+
+_DATA = None
+_DATA_LOCK = threading.Lock()
+
+# Canonical filter columns ('state', 'zip', 'date' -> column name or None),
+# filled in once when the data is first loaded
+COLUMN_MAP = {}
 
-@lru_cache(maxsize=1)
 def load_data():
-    """Load the TSV file using Polars (cached for performance)"""
-    print(f"Loading data from {DATA_PATH}...")
-    df = pl.read_csv(
-        DATA_PATH, 
-        separator='\t',
-        null_values=['NA', 'N/A', ''],  # Treat these as null
-        ignore_errors=True,  # Skip parsing errors
-        try_parse_dates=True  # Auto-parse date columns
+    """Return the shared LazyFrame, creating it on first use
+
+    Double-checked locking: after the first call this is a plain global
+    read, and concurrent first requests under gunicorn's threads cannot
+    build the scan twice.
+    """
+    global _DATA
+    if _DATA is None:
+        with _DATA_LOCK:
+            if _DATA is None:
+                lf = scan_data()
+                COLUMN_MAP.update(build_column_map(lf.columns))
+                _DATA = lf
+    return _DATA
+
+def build_column_map(columns):
+    """Resolve the columns used by the state/zip/date filters"""
+    return {
+        'state': 'STATE_CODE' if 'STATE_CODE' in columns else None,
+        'zip': next((col for col in columns if 'zip' in col.lower()), None),
+        'date': 'PERIOD_BEGIN' if 'PERIOD_BEGIN' in columns else None
+    }
+
+def scan_data():
+    """Lazily scan the Redfin data using Polars
+
+    Nothing is read until a query is collected, so filters and column
+    selections are pushed down into the reader. With the Parquet layout a
+    STATE_CODE filter also prunes every other state's partition.
+    """
+    if DATA_PATH.startswith('s3://'):
+        # Only the footers and the row groups a query needs are fetched,
+        # using HTTP range requests
+        print(f"Scanning Parquet data from {DATA_PATH}...")
+        lf = pl.scan_parquet(
+            DATA_PATH.rstrip('/') + '/*/*.parquet',
+            hive_partitioning=True,
+            storage_options=r2_storage_options()
+        )
+    elif os.path.isdir(DATA_PATH):
+        print(f"Scanning Parquet data from {DATA_PATH}...")
+        lf = pl.scan_parquet(
+            os.path.join(DATA_PATH, '*', '*.parquet'),
+            hive_partitioning=True,
+            cache=True
+        )
+    else:
+        tsv_path = DATA_PATH if DATA_PATH.endswith('.tsv') else TSV_PATH
+        if tsv_path != DATA_PATH:
+            print(f"No Parquet directory at {DATA_PATH}, run convert_to_parquet.py to create it")
+        print(f"Scanning TSV data from {tsv_path}...")
+        lf = pl.scan_csv(
+            tsv_path,
+            separator='\t',
+            null_values=['NA', 'N/A', ''],  # Treat these as null
+            ignore_errors=True,  # Skip parsing errors
+            try_parse_dates=True,  # Auto-parse date columns
+            dtypes=DATE_COLUMNS,
+            low_memory=True
+        )
+    print(f"Found {len(lf.columns)} columns")
+    return lf
+
+@lru_cache(maxsize=1)
+def schema_payload():
+    """JSON body for /api/schema (built once per process)
+
+    The row count needs a full pass over the data and the output never
+    changes for a given file, so the serialized response is memoized.
+    """
+    lf = load_data()
+    lf_schema = lf.schema
+    meta = json.dumps({
+        'columns': list(lf_schema.keys()),
+        'dtypes': {col: str(dtype) for col, dtype in lf_schema.items()},
+        'row_count': lf.select(pl.count()).collect(streaming=True).item()
+    })
+    sample = lf.head(5).collect().write_json(row_oriented=True)
+    return '%s,"sample":%s}' % (meta[:-1], sample)
+
+@lru_cache(maxsize=1)
+def states_payload():
+    """JSON body for /api/states, or None without a STATE_CODE column (built once per process)"""
+    lf = load_data()
+    if 'STATE_CODE' not in lf.columns:
+        return None
+    states = (
+        lf.select(pl.col('STATE_CODE').unique().drop_nulls().sort())
+        .collect(streaming=True)['STATE_CODE']
+        .to_list()
     )
-    print(f"Loaded {len(df)} rows with {len(df.columns)} columns")
-    return df
+    return json.dumps({'states': states})
+
+@lru_cache(maxsize=None)
+def aggregated_payload(level):
+    """Raw JSON of a precomputed geography aggregate (read once per process)"""
+    with open(os.path.join(AGGREGATED_DIR, AGGREGATED_FILES[level]), 'rb') as f:
+        return f.read()
+
+def typed_literal(value, dtype):
+    """Convert a query-string value to a literal of the column's dtype
+
+    Comparing a column with a literal of another type makes Polars insert a
+    cast, which stops the filter from being pushed down into the scan.
+    """
+    if dtype == pl.Utf8:
+        value = str(value)
+    elif dtype == pl.Date:
+        value = date.fromisoformat(value)
+    elif dtype == pl.Datetime:
+        value = datetime.fromisoformat(value)
+    elif dtype.is_integer():
+        value = int(value)
+    elif dtype.is_float():
+        value = float(value)
+    return pl.lit(value, dtype=dtype)
+
+def data_response(df, **extra):
+    """Stream a {'data': [...], 'count': n, ...} JSON response from a DataFrame
+
+    Rows are serialized by Polars (Rust) a slice at a time and written out
+    as they are produced, so neither per-row Python dicts nor the whole JSON
+    document are ever held in memory at once.
+    """
+    envelope = json.dumps({'count': df.height, **extra})
+
+    def generate():
+        yield '{"data":['
+        for i, batch in enumerate(df.iter_slices(n_rows=RESPONSE_SLICE_ROWS)):
+            if i:
+                yield ','
+            # Strip the slice's own [ ] so the slices join into one array
+            yield batch.write_json(row_oriented=True)[1:-1]
+        yield '],' + envelope[1:]
+
+    return app.response_class(generate(), mimetype='application/json')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -34,14 +198,7 @@ def health_check():
 def get_schema():
     """Return column names and types"""
     try:
-        df = load_data()
-        schema = {
-            'columns': df.columns,
-            'dtypes': {col: str(dtype) for col, dtype in zip(df.columns, df.dtypes)},
-            'row_count': len(df),
-            'sample': df.head(5).to_dicts()
-        }
-        return jsonify(schema)
+        return app.response_class(schema_payload(), mimetype='application/json')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -49,16 +206,31 @@ def get_schema():
 def get_states():
     """Get list of unique states"""
     try:
-        df = load_data()
         # Use STATE_CODE column which has values like 'CA', 'TX', etc.
-        if 'STATE_CODE' in df.columns:
-            states = df['STATE_CODE'].unique().drop_nulls().sort().to_list()
-            return jsonify({'states': states})
+        payload = states_payload()
+        if payload is not None:
+            return app.response_class(payload, mimetype='application/json')
         else:
             return jsonify({'error': 'STATE_CODE column not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/aggregated/<level>', methods=['GET'])
+def get_aggregated(level):
+    """
+    Precomputed population-weighted medians by geography
+
+    level: 'state' or 'county'. These files are produced offline by the
+    map_viz aggregation script, so serving them needs no scan at all; use
+    /api/aggregate for any other grouping.
+    """
+    if level not in AGGREGATED_FILES:
+        return jsonify({'error': f"Unknown level '{level}', expected one of {sorted(AGGREGATED_FILES)}"}), 404
+    try:
+        return app.response_class(aggregated_payload(level), mimetype='application/json')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/data', methods=['GET'])
 def get_data():
     """
@@ -74,7 +246,9 @@ def get_data():
     - limit: Max rows to return (default 1000)
     """
     try:
-        df = load_data()
+        lf = load_data()
+        lf_schema = lf.schema
+        columns = lf.columns
         
         # Apply filters
         state = request.args.get('state')
@@ -85,51 +259,53 @@ def get_data():
         group_by = request.args.get('group_by')
         limit = int(request.args.get('limit', 1000))
         
+        # Collect every filter into one predicate so the scan sees a single
+        # filter node, whatever the optimizer settings
+        predicates = []
+        
+        state_col = COLUMN_MAP['state']
+        zip_col = COLUMN_MAP['zip']
+        date_col = COLUMN_MAP['date']
+        
         # Filter by state
-        if state:
-            if 'STATE_CODE' in df.columns:
-                df = df.filter(pl.col('STATE_CODE') == state)
+        if state and state_col:
+            predicates.append(pl.col(state_col) == typed_literal(state, lf_schema[state_col]))
         
         # Filter by zip code
-        if zip_code:
-            zip_col = next((col for col in df.columns if 'zip' in col.lower()), None)
-            if zip_col:
-                df = df.filter(pl.col(zip_col) == zip_code)
+        if zip_code and zip_col:
+            predicates.append(pl.col(zip_col) == typed_literal(zip_code, lf_schema[zip_col]))
         
         # Filter by date range
-        if start_date or end_date:
-            if 'PERIOD_BEGIN' in df.columns:
-                if start_date:
-                    df = df.filter(pl.col('PERIOD_BEGIN') >= start_date)
-                if end_date:
-                    df = df.filter(pl.col('PERIOD_BEGIN') <= end_date)
+        if date_col:
+            if start_date:
+                predicates.append(pl.col(date_col) >= typed_literal(start_date, lf_schema[date_col]))
+            if end_date:
+                predicates.append(pl.col(date_col) <= typed_literal(end_date, lf_schema[date_col]))
+        
+        if predicates:
+            lf = lf.filter(reduce(operator.and_, predicates))
         
         # Group and aggregate if requested
         if group_by and metric:
-            if group_by in df.columns and metric in df.columns:
-                df = df.group_by(group_by).agg(
+            if group_by in columns and metric in columns:
+                # Only these two columns are read from disk
+                lf = lf.select(list(dict.fromkeys([group_by, metric])))
+                lf = lf.group_by(group_by).agg(
                     pl.col(metric).mean().alias(f'avg_{metric}'),
                     pl.col(metric).median().alias(f'median_{metric}'),
                     pl.col(metric).count().alias('count')
                 ).sort(group_by)
         
-        # Limit results
-        df = df.head(limit)
+        # Limit results, then run the query (only now is the file read)
+        df = lf.head(limit).collect(streaming=True)
         
-        # Convert to JSON
-        result = df.to_dicts()
-        
-        return jsonify({
-            'data': result,
-            'count': len(result),
-            'filters_applied': {
-                'state': state,
-                'zip_code': zip_code,
-                'start_date': start_date,
-                'end_date': end_date,
-                'metric': metric,
-                'group_by': group_by
-            }
+        return data_response(df, filters_applied={
+            'state': state,
+            'zip_code': zip_code,
+            'start_date': start_date,
+            'end_date': end_date,
+            'metric': metric,
+            'group_by': group_by
         })
     
     except Exception as e:
@@ -140,20 +316,33 @@ def get_data():
 @app.route('/api/aggregate', methods=['POST'])
 def aggregate_data():
     """
-    Advanced aggregation endpoint with limit to prevent timeouts
+    Advanced aggregation endpoint
+
+    JSON body:
+    - filters: {column: value} equality filters (optional)
+    - group_by: List of columns to group by
+    - aggregations: {column: ['mean', 'median', 'sum', 'min', 'max', 'count']}
+    - limit: Max result rows to return (default 100, at most 5000)
+
+    The aggregation always runs over every filtered row; only the result
+    is limited.
     """
     try:
-        df = load_data()
+        lf = load_data()
+        lf_schema = lf.schema
+        columns = lf.columns
         params = request.get_json()
+        limit = min(int(params.get('limit', 100)), MAX_AGGREGATE_ROWS)
         
-        # Apply filters first to reduce data size
+        # Apply filters first to reduce data size, as one predicate so the
+        # scan sees a single filter node
         filters = params.get('filters', {})
-        for col, value in filters.items():
-            if col in df.columns:
-                df = df.filter(pl.col(col) == value)
-        
-        # Limit data before aggregation to prevent timeout
-        df = df.head(10000)  # Process max 10k rows
+        predicates = [
+            pl.col(col) == typed_literal(value, lf_schema[col])
+            for col, value in filters.items() if col in columns
+        ]
+        if predicates:
+            lf = lf.filter(reduce(operator.and_, predicates))
         
         # Group by
         group_cols = params.get('group_by', [])
@@ -162,7 +351,7 @@ def aggregate_data():
         if group_cols and aggregations:
             agg_exprs = []
             for col, agg_funcs in aggregations.items():
-                if col in df.columns:
+                if col in columns:
                     for func in agg_funcs:
                         if func == 'mean':
                             agg_exprs.append(pl.col(col).mean().alias(f'{col}_{func}'))
@@ -178,20 +367,19 @@ def aggregate_data():
                             agg_exprs.append(pl.col(col).count().alias(f'{col}_{func}'))
             
             if agg_exprs:
-                df = df.group_by(group_cols).agg(agg_exprs).sort(group_cols[0])
+                lf = lf.group_by(group_cols).agg(agg_exprs).sort(group_cols[0])
         
         # Limit final results
-        df = df.head(100)
-        result = df.to_dicts()
+        df = lf.head(limit).collect(streaming=True)
         
-        return jsonify({
-            'data': result,
-            'count': len(result)
-        })
+        return data_response(df)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    debug = os.environ.get('FLASK_DEBUG', '0') == '1'
+    # The reloader runs the app in a second process, which would scan the
+    # data and build the cached payloads twice
+    app.run(host='0.0.0.0', port=port, debug=debug, use_reloader=False)
\ No newline at end of file
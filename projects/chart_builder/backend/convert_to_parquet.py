@@ -0,0 +1,103 @@
+"""
+Convert the Redfin TSV to Hive-partitioned Parquet
+===================================================
+One-time preprocessing step for the chart builder API. Parquet is columnar and
+ZSTD-compressed, so the API reads only the columns a query needs, and the
+STATE_CODE=XX directories let a state filter skip every other state entirely.
+
+Input:  redfin_zip_all_states.tsv
+Output: redfin_parquet/STATE_CODE=XX/data.parquet
+
+Usage:
+    python convert_to_parquet.py
+    python convert_to_parquet.py --input path/to/file.tsv --output path/to/dir
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+import polars as pl
+
+TSV_PATH = os.environ.get('TSV_PATH', r'C:\personal_projects\chadvo-ds-website\projects\map_viz\data\redfin\raw\redfin_zip_all_states.tsv')
+PARQUET_DIR = os.environ.get('DATA_PATH', r'C:\personal_projects\chadvo-ds-website\projects\map_viz\data\redfin\redfin_parquet')
+
+PARTITION_COLUMN = 'STATE_CODE'
+
+# Stored as Date so the API's date filters can prune row groups by min/max
+DATE_COLUMNS = {'PERIOD_BEGIN': pl.Date, 'PERIOD_END': pl.Date}
+
+
+def scan_tsv(input_path):
+    """Lazily scan the Redfin TSV with the same options the API uses"""
+    return pl.scan_csv(
+        input_path,
+        separator='\t',
+        null_values=['NA', 'N/A', ''],
+        ignore_errors=True,
+        try_parse_dates=True,
+        dtypes=DATE_COLUMNS,
+        low_memory=True
+    )
+
+
+def convert_tsv_to_parquet(input_path=TSV_PATH, output_dir=PARQUET_DIR, row_group_size=100_000):
+    """
+    Write one Parquet file per state under output_dir/STATE_CODE=XX/.
+
+    Every step is streamed, so peak memory stays small regardless of the TSV
+    size. The TSV is parsed only once, into a temporary unpartitioned
+    Parquet file; the per-state files are then cut from that file, which is
+    far cheaper to re-scan than the text. The partition column is dropped
+    from the files themselves; Polars restores it from the directory name
+    when scanning with hive_partitioning=True. Rows without a STATE_CODE are
+    skipped.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    staging_path = output_dir / '_staging.parquet'
+
+    print(f"Converting TSV file: {input_path}")
+    scan_tsv(input_path).sink_parquet(staging_path, compression='lz4', row_group_size=row_group_size)
+
+    try:
+        staged = pl.scan_parquet(staging_path)
+        states = (
+            staged
+            .select(pl.col(PARTITION_COLUMN).unique().drop_nulls().sort())
+            .collect(streaming=True)[PARTITION_COLUMN]
+            .to_list()
+        )
+        print(f"Found {len(states)} states")
+
+        for state in states:
+            state_dir = output_dir / f"{PARTITION_COLUMN}={state}"
+            state_dir.mkdir(parents=True, exist_ok=True)
+            (
+                staged
+                .filter(pl.col(PARTITION_COLUMN) == state)
+                .drop(PARTITION_COLUMN)
+                .sink_parquet(
+                    state_dir / 'data.parquet',
+                    compression='zstd',
+                    row_group_size=row_group_size
+                )
+            )
+            print(f"  {state}: done")
+    finally:
+        staging_path.unlink()
+
+    print(f"OK Wrote {len(states)} partitions to {output_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the Redfin TSV to Hive-partitioned Parquet')
+    parser.add_argument('--input', default=TSV_PATH, help='Path to the Redfin TSV file')
+    parser.add_argument('--output', default=PARQUET_DIR, help='Output directory for the Parquet partitions')
+    args = parser.parse_args()
+
+    convert_tsv_to_parquet(args.input, args.output)
+
+
+if __name__ == '__main__':
+    main()
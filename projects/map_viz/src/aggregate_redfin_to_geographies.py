@@ -12,12 +12,13 @@ Output: data/redfin/processed/redfin_state_aggregated.json
         data/redfin/processed/redfin_cbsa_aggregated.json
 """
 
-import pandas as pd
-import numpy as np
-import json
+import polars as pl
+import orjson
 from pathlib import Path
 from datetime import datetime
-from collections import defaultdict
+
+# Print skewness/rank statistics for the derived columns
+VERBOSE = False
 
 # Paths
 SCRIPT_DIR = Path(__file__).parent
@@ -66,16 +67,15 @@ def load_redfin_zip_data():
     print("LOADING REDFIN ZIP-LEVEL DATA")
     print("="*80)
 
-    with open(REDFIN_ZIP_JSON, 'r') as f:
-        data = json.load(f)
+    data = orjson.loads(REDFIN_ZIP_JSON.read_bytes())
 
-    df = pd.DataFrame(data['data'])
+    df = pl.from_dicts(data['data'], infer_schema_length=None)
 
     # Ensure ZIP is 5-digit string
-    df['ZIP'] = df['ZIP'].astype(str).str.zfill(5)
+    df = df.with_columns(pl.col('ZIP').cast(pl.Utf8).str.zfill(5))
 
     print(f"OK Loaded {len(df):,} ZIP code records")
-    print(f"OK Period: {df['PERIOD_END'].iloc[0]}")
+    print(f"OK Period: {df['PERIOD_END'][0]}")
     print(f"OK Metrics: {', '.join(REDFIN_METRICS)}")
 
     return df
@@ -87,49 +87,44 @@ def load_zip_reference():
     print("LOADING ZIP CODE REFERENCE DATA")
     print("="*80)
 
-    df = pd.read_csv(ZIP_REFERENCE, dtype={'zip': str, 'county_fips': str, 'state_id': str})
-    df = df.rename(columns={'zip': 'ZIP', 'state_id': 'STATE', 'county_fips': 'COUNTY_FIPS'})
-
-    # Ensure ZIP is 5-digit string
-    df['ZIP'] = df['ZIP'].str.zfill(5)
-
-    # Ensure County FIPS is 5-digit (state + county)
-    df['COUNTY_FIPS'] = df['COUNTY_FIPS'].str.zfill(5)
-
-    # Extract State FIPS (first 2 digits of county FIPS)
-    df['STATE_FIPS'] = df['COUNTY_FIPS'].str[:2]
+    df = pl.read_csv(
+        ZIP_REFERENCE,
+        columns=['zip', 'state_id', 'county_fips', 'county_name', 'state_name', 'population'],
+        schema_overrides={'zip': pl.Utf8, 'county_fips': pl.Utf8, 'state_id': pl.Utf8, 'population': pl.Float64}
+    )
+    df = df.rename({'zip': 'ZIP', 'state_id': 'STATE', 'county_fips': 'COUNTY_FIPS'})
+
+    df = df.with_columns(
+        # Ensure ZIP is 5-digit string
+        pl.col('ZIP').str.zfill(5),
+        # Ensure County FIPS is 5-digit (state + county)
+        pl.col('COUNTY_FIPS').str.zfill(5)
+    ).with_columns(
+        # Extract State FIPS (first 2 digits of county FIPS)
+        pl.col('COUNTY_FIPS').str.slice(0, 2).alias('STATE_FIPS')
+    )
 
     print(f"OK Loaded {len(df):,} ZIP codes")
-    print(f"OK Unique states: {df['STATE_FIPS'].nunique()}")
-    print(f"OK Unique counties: {df['COUNTY_FIPS'].nunique()}")
+    print(f"OK Unique states: {df['STATE_FIPS'].n_unique()}")
+    print(f"OK Unique counties: {df['COUNTY_FIPS'].n_unique()}")
 
-    return df[['ZIP', 'STATE_FIPS', 'COUNTY_FIPS', 'STATE', 'county_name', 'state_name', 'population']]
+    return df.select(['ZIP', 'STATE_FIPS', 'COUNTY_FIPS', 'STATE', 'county_name', 'state_name', 'population'])
 
 
-def weighted_median(values, weights):
-    """Calculate weighted median"""
-    if len(values) == 0:
-        return None
-
-    # Remove NaN values
-    mask = ~np.isnan(values) & ~np.isnan(weights)
-    values = values[mask]
-    weights = weights[mask]
-
-    if len(values) == 0:
-        return None
-
-    # Sort by values
-    sorted_indices = np.argsort(values)
-    sorted_values = values[sorted_indices]
-    sorted_weights = weights[sorted_indices]
+def weighted_median_expr(metric):
+    """
+    Weighted median of a metric as a Polars aggregation expression
 
-    # Calculate cumulative weight
-    cumsum = np.cumsum(sorted_weights)
-    cutoff = 0.5 * np.sum(sorted_weights)
+    Within each group: drop missing values, sort by value, and take the first
+    value whose cumulative weight reaches half of the total weight.
+    """
+    values = pl.col(metric).cast(pl.Float64).fill_nan(None)
+    valid = values.is_not_null()
+    sorted_values = values.filter(valid).sort()
+    sorted_weights = pl.col('weight').filter(valid).sort_by(values.filter(valid))
 
-    # Find median
-    return float(sorted_values[cumsum >= cutoff][0])
+    cutoff = 0.5 * sorted_weights.sum()
+    return sorted_values.filter(sorted_weights.cum_sum() >= cutoff).first().alias(metric)
 
 
 def aggregate_to_geography(redfin_df, zip_ref_df, geo_column, geo_name):
@@ -146,52 +141,46 @@ def aggregate_to_geography(redfin_df, zip_ref_df, geo_column, geo_name):
     print(f"AGGREGATING TO {geo_name.upper()} LEVEL")
     print('='*80)
 
-    # Merge Redfin data with ZIP reference
-    merged = redfin_df.merge(zip_ref_df, on='ZIP', how='left')
+    # Only carry the columns the aggregation uses through the join
+    redfin_columns = ['ZIP', *[c for c in [*REDFIN_METRICS, 'PERIOD_END'] if c in redfin_df.columns]]
+    ref_columns = ['ZIP', geo_column, 'population', 'state_name']
+    if geo_name == 'County':
+        ref_columns.append('county_name')
 
-    # Remove records without geography mapping
-    merged = merged[merged[geo_column].notna()]
+    # Join Redfin data with ZIP reference, dropping records without geography mapping
+    merged = (
+        redfin_df.select(redfin_columns)
+        .join(zip_ref_df.select(ref_columns), on='ZIP', how='left')
+        .filter(pl.col(geo_column).is_not_null())
+    )
 
     print(f"OK Matched {len(merged):,} / {len(redfin_df):,} records ({len(merged)/len(redfin_df)*100:.1f}%)")
 
-    # Use population as weight for aggregation
-    merged['weight'] = merged['population'].fillna(1)
-
-    # Group by geography
-    aggregated = []
-
-    for geo_id, group in merged.groupby(geo_column):
-        record = {
-            geo_column: geo_id,
-            'ZIP_COUNT': len(group),
-            'TOTAL_POPULATION': int(group['weight'].sum())
-        }
-
-        # Aggregate each metric
-        for metric in REDFIN_METRICS:
-            if metric in group.columns:
-                values = group[metric].values
-                weights = group['weight'].values
-
-                # Calculate weighted median
-                result = weighted_median(values, weights)
-
-                if result is not None:
-                    record[metric] = result
-
-        # Add metadata
-        if 'PERIOD_END' in group.columns:
-            record['PERIOD_END'] = group['PERIOD_END'].iloc[0]
-
-        if 'state_name' in group.columns:
-            record['STATE_NAME'] = group['state_name'].iloc[0]
-
-        if 'county_name' in group.columns and geo_name == 'County':
-            record['COUNTY_NAME'] = group['county_name'].iloc[0]
-
-        aggregated.append(record)
-
-    result_df = pd.DataFrame(aggregated)
+    # Aggregate every metric for every geography in one Polars pass
+    metrics = [m for m in REDFIN_METRICS if m in merged.columns]
+
+    agg_exprs = [
+        pl.len().alias('ZIP_COUNT'),
+        pl.col('weight').sum().cast(pl.Int64).alias('TOTAL_POPULATION'),
+        *[weighted_median_expr(metric) for metric in metrics]
+    ]
+
+    # Add metadata
+    meta_columns = {'PERIOD_END': 'PERIOD_END', 'state_name': 'STATE_NAME'}
+    if geo_name == 'County':
+        meta_columns['county_name'] = 'COUNTY_NAME'
+    meta_columns = {col: alias for col, alias in meta_columns.items() if col in merged.columns}
+    agg_exprs += [pl.col(col).first().alias(alias) for col, alias in meta_columns.items()]
+
+    result_df = (
+        merged.lazy()
+        # Use population as weight for aggregation
+        .with_columns(pl.col('population').fill_null(1).alias('weight'))
+        .group_by(geo_column)
+        .agg(agg_exprs)
+        .sort(geo_column)
+        .collect()
+    )
 
     print(f"OK Aggregated to {len(result_df):,} {geo_name.lower()}s")
     print(f"OK Avg ZIPs per {geo_name.lower()}: {result_df['ZIP_COUNT'].mean():.1f}")
@@ -199,56 +188,47 @@ def aggregate_to_geography(redfin_df, zip_ref_df, geo_column, geo_name):
     # Show sample statistics
     for metric in REDFIN_METRICS:
         if metric in result_df.columns:
-            count = result_df[metric].notna().sum()
+            count = result_df[metric].is_not_null().sum()
             print(f"  - {metric}: {count} {geo_name.lower()}s with data")
 
     return result_df
 
 
-def apply_log_transformation(df):
-    """Apply log transformation to skewed metrics"""
-    print("\n" + "="*80)
-    print("APPLYING LOG TRANSFORMATION")
-    print("="*80)
-
-    for metric in LOG_METRICS:
-        if metric in df.columns:
-            log_col = f"{metric}_LOG"
-            df[log_col] = np.log1p(df[metric].fillna(0))
-
-            # Stats
-            before_skew = df[metric].skew()
-            after_skew = df[log_col].skew()
-            print(f"  {metric}:")
-            print(f"    Skewness: {before_skew:.2f} -> {after_skew:.2f} (improved {before_skew - after_skew:.2f})")
-
-    print("OK Log transformation complete")
-    return df
-
+def apply_transformations(df, verbose=VERBOSE):
+    """
+    Add log-transformed (*_LOG) and percentile-ranked (*_RANK, 0.0 to 1.0) columns
 
-def apply_percentile_ranking(df):
-    """Apply percentile ranking for smooth gradients (0.0 to 1.0)"""
+    All derived columns are computed in a single with_columns call. The
+    skewness/range statistics need extra passes over every column, so they
+    are only printed when verbose is set.
+    """
     print("\n" + "="*80)
-    print("APPLYING PERCENTILE RANKING")
+    print("APPLYING LOG TRANSFORMATION AND PERCENTILE RANKING")
     print("="*80)
 
-    for metric in RANK_METRICS:
-        if metric in df.columns:
-            rank_col = f"{metric}_RANK"
+    log_metrics = [m for m in LOG_METRICS if m in df.columns]
+    rank_metrics = [m for m in RANK_METRICS if m in df.columns]
 
-            # Calculate percentile rank (0.0 to 1.0)
-            df[rank_col] = df[metric].rank(pct=True)
+    df = df.with_columns(
+        *[pl.col(m).fill_null(0).log1p().alias(f"{m}_LOG") for m in log_metrics],
+        # Percentile rank, leaving missing values null
+        *[(pl.col(m).rank('average') / pl.col(m).count()).alias(f"{m}_RANK") for m in rank_metrics]
+    )
 
-            # Stats
-            min_rank = df[rank_col].min()
-            max_rank = df[rank_col].max()
-            median_rank = df[rank_col].median()
+    if verbose:
+        for metric in log_metrics:
+            before_skew = df[metric].skew(bias=False)
+            after_skew = df[f"{metric}_LOG"].skew(bias=False)
+            print(f"  {metric}:")
+            print(f"    Skewness: {before_skew:.2f} -> {after_skew:.2f} (improved {before_skew - after_skew:.2f})")
 
+        for metric in rank_metrics:
+            rank = df[f"{metric}_RANK"]
             print(f"  {metric}_RANK:")
-            print(f"    Range: {min_rank:.4f} to {max_rank:.4f}")
-            print(f"    Median: {median_rank:.4f}")
+            print(f"    Range: {rank.min():.4f} to {rank.max():.4f}")
+            print(f"    Median: {rank.median():.4f}")
 
-    print("OK Percentile ranking complete")
+    print(f"OK Added {len(log_metrics)} log and {len(rank_metrics)} rank columns")
     return df
 
 
@@ -259,7 +239,7 @@ def save_json(df, output_path, geo_name):
     print('='*80)
 
     # Convert DataFrame to dict
-    data = df.to_dict('records')
+    data = df.to_dicts()
 
     # Create output structure
     output = {
@@ -268,7 +248,7 @@ def save_json(df, output_path, geo_name):
             'geography_level': geo_name,
             'generated_at': datetime.now().isoformat(),
             'record_count': len(data),
-            'latest_period': df['PERIOD_END'].iloc[0] if 'PERIOD_END' in df.columns else None,
+            'latest_period': df['PERIOD_END'][0] if 'PERIOD_END' in df.columns else None,
             'aggregation_method': 'Population-weighted median',
             'log_transformed_metrics': LOG_METRICS,
             'percentile_ranked_metrics': RANK_METRICS,
@@ -283,8 +263,7 @@ def save_json(df, output_path, geo_name):
 
     # Save
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(output, f, indent=2)
+    output_path.write_bytes(orjson.dumps(output, option=orjson.OPT_INDENT_2))
 
     file_size = output_path.stat().st_size / 1024
     print(f"OK Saved to: {output_path}")
@@ -305,14 +284,12 @@ def main():
 
         # 1. AGGREGATE TO STATE LEVEL
         state_df = aggregate_to_geography(redfin_df, zip_ref_df, 'STATE_FIPS', 'State')
-        state_df = apply_log_transformation(state_df)
-        state_df = apply_percentile_ranking(state_df)
+        state_df = apply_transformations(state_df)
         save_json(state_df, STATE_OUTPUT, 'State')
 
         # 2. AGGREGATE TO COUNTY LEVEL
         county_df = aggregate_to_geography(redfin_df, zip_ref_df, 'COUNTY_FIPS', 'County')
-        county_df = apply_log_transformation(county_df)
-        county_df = apply_percentile_ranking(county_df)
+        county_df = apply_transformations(county_df)
         save_json(county_df, COUNTY_OUTPUT, 'County')
 
         print("\n" + "="*80)
@@ -0,0 +1,177 @@
+"""
+Shared helpers for the Census/BEA/HUD fetch scripts
+(fetch_cbsa_data.py, fetch_state_data.py, fetch_zip_data.py, fetch_county_data.py):
+HTTP session setup, year detection/fallback, ACS parsing and output writing.
+"""
+
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import orjson
+import polars as pl
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# On-disk HTTP response cache, one sqlite file per script
+HTTP_CACHE_DIR = Path(__file__).parent / '.http_cache'
+HTTP_CACHE_EXPIRE = 7 * 24 * 60 * 60  # seconds
+
+# Census placeholders for missing/suppressed values (the negative
+# 'annotation' values mark estimates that could not be computed, are
+# suppressed or are top/bottom-coded, so they are never real numbers)
+ACS_NULLS = frozenset((
+    None, '', 'null',
+    '-666666666', '-999999999', '-888888888', '-555555555', '-333333333', '-222222222'
+))
+
+# ==================== HTTP ====================
+
+def create_session_with_retries(cache_name, pool_maxsize=10, **cache_options):
+    """
+    Cached session with retries, for one script's cache (.http_cache/<cache_name>).
+
+    Responses are cached on disk: ACS/BEA/HUD values for a given year do
+    not change between runs, so repeat runs mostly skip the network.
+    pool_maxsize should cover the most requests the script has in flight to
+    one host; cache_options are passed on to CachedSession.
+    """
+    session = requests_cache.CachedSession(
+        HTTP_CACHE_DIR / cache_name, backend='sqlite', expire_after=HTTP_CACHE_EXPIRE,
+        allowable_methods=('GET',), cache_control=True,
+        # If a refresh fails (network error or 5xx), serve the expired copy
+        stale_if_error=True,
+        # Keep credentials out of the cache keys (and the stored requests)
+        ignored_parameters=['key', 'UserID', 'Authorization'],
+        **cache_options
+    )
+    retry = Retry(
+        total=5, backoff_factor=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"]
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def shared_session(create):
+    """
+    get_session() for a script: the session is built by create() on first
+    use (thread-safe) and then shared by every fetcher, so connections (and
+    TLS handshakes) are reused across stages instead of rebuilt per function.
+    """
+    session = None
+    lock = threading.Lock()
+
+    def get_session():
+        nonlocal session
+        if session is None:
+            with lock:
+                if session is None:
+                    session = create()
+        return session
+
+    return get_session
+
+# ==================== YEARS ====================
+
+def fetch_with_year_fallback(fetch_func, start_year, max_retries=3):
+    current_year = start_year
+    for i in range(max_retries + 1):
+        data = fetch_func(current_year)
+        if data:
+            if current_year != start_year:
+                print(f'   ↳ Fallback to {current_year} worked!')
+            return data, current_year
+        if i < max_retries:
+            print(f'   ⚠ No data for {current_year}, trying {current_year - 1}...')
+            current_year -= 1
+    print(f'   ❌ Failed after checking back to {current_year}')
+    return {}, start_year
+
+def latest_available_year(years, get, ok=lambda resp: resp.status_code == 200):
+    """Newest of years for which ok(get(year)) is true, or None
+
+    All candidate years are probed at once rather than walking backwards
+    one request at a time, and the answer is returned as soon as every
+    newer year has been ruled out, without waiting for older probes.
+    """
+    def available(year):
+        try: return ok(get(year))
+        except: return False
+
+    executor = ThreadPoolExecutor(max_workers=len(years))
+    try:
+        futures = {year: executor.submit(available, year) for year in years}
+        for year in sorted(futures, reverse=True):
+            if futures[year].result():
+                return year
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# ==================== CENSUS ====================
+
+def parse_acs_table(data, geo_columns, float_variables=frozenset()):
+    """
+    ACS JSON rows (header first) -> Polars DataFrame with numeric columns
+
+    Every column except NAME and the geo_columns is a variable: sentinels
+    become null and each is cast (Float64 if in float_variables, else
+    Int64) in one vectorized pass, instead of checking and converting each
+    cell in Python.
+    """
+    df = pl.DataFrame(data[1:], schema=data[0], orient='row')
+    sentinels = [v for v in ACS_NULLS if v is not None]
+    return df.with_columns([
+        pl.when(pl.col(var).is_in(sentinels)).then(None).otherwise(pl.col(var))
+        .cast(pl.Float64 if var in float_variables else pl.Int64, strict=False)
+        .alias(var)
+        for var in data[0] if var != 'NAME' and var not in geo_columns
+    ])
+
+def add_acs_rates(df):
+    """
+    Adds povertyRate, employmentRate and unemploymentRate (percent, 1 decimal)
+    as columns, computed for all rows at once instead of row by row.
+    """
+    poverty_universe = pl.col('B17001_001E')
+    poverty = pl.col('B17001_002E')
+    civ_labor_force = pl.col('B23025_003E').fill_null(0)
+    
+    def share_of_labor_force(var):
+        rate = (pl.col(var).fill_null(0) / civ_labor_force * 100).round(1)
+        return pl.when(civ_labor_force > 0).then(rate).otherwise(None)
+    
+    return df.with_columns(
+        povertyRate=pl.when((poverty_universe > 0) & (poverty > 0))
+            .then((poverty / poverty_universe * 100).round(1))
+            .otherwise(None),
+        employmentRate=share_of_labor_force('B23025_004E'),
+        unemploymentRate=share_of_labor_force('B23025_005E')
+    )
+
+# ==================== OUTPUT ====================
+
+def write_json_atomic(filepath, output):
+    """
+    Write output as indented JSON to filepath.
+
+    Written to a temp file in the same directory, then swapped in, so a
+    crash mid-write never leaves a truncated file for the map to load.
+    """
+    filepath = Path(filepath)
+    tmp = tempfile.NamedTemporaryFile(dir=filepath.parent, suffix='.tmp', delete=False)
+    try:
+        with tmp:
+            tmp.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
+        os.chmod(tmp.name, 0o644)  # NamedTemporaryFile creates files owner-only
+        os.replace(tmp.name, filepath)
+    except BaseException:
+        # Never leave a stray .tmp behind in the published data directory
+        os.unlink(tmp.name)
+        raise
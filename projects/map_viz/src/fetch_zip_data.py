@@ -2,20 +2,26 @@
 Complete Zip Code (ZCTA) Data Fetcher
 Fetches Census ACS data for all US Zip Code Tabulation Areas.
 Iterates by State to handle the large volume of Zip Codes (33k+) without timeouts.
+
+Requires the CENSUS_API_KEY environment variable.
 """
 
-import requests
+import argparse
 import json
+import os
 from pathlib import Path
-import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from operator import itemgetter
 from datetime import datetime
 
+from fetch_common import (
+    ACS_NULLS, create_session_with_retries, shared_session, fetch_with_year_fallback,
+    latest_available_year, write_json_atomic
+)
+
 # ============================================================
-# API KEYS
+# API KEYS (read from the environment, never committed)
 # ============================================================
-CENSUS_API_KEY = '7e9febefb3835ac0c2796d2e00df516e60c3e406'
+CENSUS_API_KEY = os.environ.get('CENSUS_API_KEY')
 
 # State FIPS Mapping (Used to iterate Zips by State)
 STATE_FIPS_TO_CODE = {
@@ -30,41 +36,19 @@ STATE_FIPS_TO_CODE = {
     '54': 'WV', '55': 'WI', '56': 'WY'
 }
 
-def create_session_with_retries():
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5, backoff_factor=2, 
-        status_forcelist=[429, 500, 502, 503, 504], 
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
-def fetch_with_year_fallback(fetch_func, start_year, max_retries=3):
-    current_year = start_year
-    for i in range(max_retries + 1):
-        data = fetch_func(current_year)
-        if data:
-            if current_year != start_year:
-                print(f'   ↳ Fallback to {current_year} worked!')
-            return data, current_year
-        if i < max_retries:
-            print(f'   ⚠ No data for {current_year}, trying {current_year - 1}...')
-            current_year -= 1
-    print(f'   ❌ Failed after checking back to {current_year}')
-    return {}, start_year
+# Responses are cached in .http_cache/zip (clear with --no-cache)
+get_session = shared_session(lambda: create_session_with_retries('zip'))
 
 def detect_latest_census_year():
     print('Detecting latest Census ACS...')
-    session = create_session_with_retries()
-    for year in range(2025, 2015, -1):
-        try:
-            if session.get(f'https://api.census.gov/data/{year}/acs/acs5', timeout=10).status_code == 200:
-                print(f'✓ Latest ACS: {year}')
-                return year
-        except: continue
+    session = get_session()
+    year = latest_available_year(
+        range(2025, 2015, -1),
+        lambda year: session.get(f'https://api.census.gov/data/{year}/acs/acs5', timeout=10)
+    )
+    if year:
+        print(f'✓ Latest ACS: {year}')
+        return year
     return 2023
 
 # ==================== HELPER: BATCH FETCH BY STATE ====================
@@ -75,7 +59,7 @@ def fetch_census_by_state_loop(year, variables, label):
     Necessary because fetching all 33k Zips at once often times out or hits limits.
     """
     print(f'Fetching {label} (ACS {year})...')
-    session = create_session_with_retries()
+    session = get_session()
     combined_result = {}
     
     # Counter for progress
@@ -84,10 +68,13 @@ def fetch_census_by_state_loop(year, variables, label):
     
     for fips, abbr in STATE_FIPS_TO_CODE.items():
         # URL for ZCTAs within a specific state
-        url = f'https://api.census.gov/data/{year}/acs/acs5?get={",".join(variables)}&for=zip%20code%20tabulation%20area:*&in=state:{fips}&key={CENSUS_API_KEY}'
+        params = {
+            'get': ','.join(variables), 'for': 'zip code tabulation area:*',
+            'in': f'state:{fips}', 'key': CENSUS_API_KEY
+        }
         
         try:
-            resp = session.get(url, timeout=10)
+            resp = session.get(f'https://api.census.gov/data/{year}/acs/acs5', params=params, timeout=10)
             if resp.status_code == 200:
                 data = resp.json()
                 # Skip header row
@@ -113,96 +100,130 @@ def fetch_census_by_state_loop(year, variables, label):
 
 # ==================== CENSUS FETCHERS (ZIP LEVEL) ====================
 
-def fetch_household_economics(year):
-    # Variables: Median Income, Poverty Universe, Poverty Count
-    variables = ['NAME', 'B19013_001E', 'B17001_001E', 'B17001_002E']
-    
-    raw_data = fetch_census_by_state_loop(year, variables, "household economics")
+# Variables per output group; all of them are fetched in one request per state
+# (no NAME: a ZCTA's name is always 'ZCTA5 <zip>', so it is built locally
+# instead of downloading ~33k copies of it)
+HOUSEHOLD_ECONOMICS_VARIABLES = ['B19013_001E', 'B17001_001E', 'B17001_002E']
+HOUSING_CHARACTERISTICS_VARIABLES = [
+    'B25001_001E', 'B25002_001E', 'B25002_002E', 'B25002_003E',
+    'B25003_001E', 'B25003_002E', 'B25003_003E', 'B25035_001E'
+]
+HOUSING_VALUES_VARIABLES = ['B25077_001E', 'B25064_001E', 'B25088_002E', 'B25088_003E']
+DEMOGRAPHICS_VARIABLES = ['B01003_001E', 'B01002_001E', 'B23025_003E', 'B23025_004E', 'B23025_005E']
+
+ACS_VARIABLES = (
+    HOUSEHOLD_ECONOMICS_VARIABLES + HOUSING_CHARACTERISTICS_VARIABLES
+    + HOUSING_VALUES_VARIABLES + DEMOGRAPHICS_VARIABLES
+)
+
+def acs_columns(variables):
+    """itemgetter pulling variables (in order) out of an ACS_VARIABLES row"""
+    return itemgetter(*(ACS_VARIABLES.index(v) for v in variables))
+
+def fetch_acs_data(year):
+    """
+    Fetches household economics, housing characteristics, housing values
+    and demographics for all ZCTAs with one request per state, instead of
+    one per state for every group.
+
+    Returns {'householdEconomics': {...}, 'housingCharacteristics': {...},
+    'housingValues': {...}, 'demographics': {...}}, each keyed by ZCTA,
+    or {} if the year has no data.
+    """
+    raw_data = fetch_census_by_state_loop(year, ACS_VARIABLES, "ACS data")
+    if not raw_data:
+        return {}
     
+    return {
+        'householdEconomics': parse_household_economics(raw_data),
+        'housingCharacteristics': parse_housing_characteristics(raw_data),
+        'housingValues': parse_housing_values_costs(raw_data),
+        'demographics': parse_demographics(raw_data)
+    }
+
+def parse_household_economics(raw_data):
+    # ~33k rows per group: bind the globals used per cell to locals
+    nulls, to_int, to_round = ACS_NULLS, int, round
+    columns = acs_columns(HOUSEHOLD_ECONOMICS_VARIABLES)
     result = {}
     for zip_code, row in raw_data.items():
+        income, total_pop, poverty = columns(row)
         try:
-            total_pop = int(row[2]) if row[2] not in ['-666666666', 'null'] else None
-            poverty = int(row[3]) if row[3] not in ['-666666666', 'null'] else None
+            total_pop = to_int(total_pop) if total_pop not in nulls else None
+            poverty = to_int(poverty) if poverty not in nulls else None
             
             result[zip_code] = {
-                'name': row[0],
+                'name': f'ZCTA5 {zip_code}',
                 'zipCode': zip_code,
-                'medianHouseholdIncome': int(row[1]) if row[1] not in ['-666666666', 'null'] else None,
-                'povertyRate': round((poverty / total_pop) * 100, 1) if total_pop and poverty else None
+                'medianHouseholdIncome': to_int(income) if income not in nulls else None,
+                'povertyRate': to_round((poverty / total_pop) * 100, 1) if total_pop and poverty else None
             }
         except: continue
         
     return result
 
-def fetch_housing_characteristics(year):
+def parse_housing_characteristics(raw_data):
     # Units, Occupancy, Vacancy, Tenure, Year Built
-    variables = [
-        'NAME', 'B25001_001E', 'B25002_001E', 'B25002_002E', 'B25002_003E',
-        'B25003_001E', 'B25003_002E', 'B25003_003E', 'B25035_001E'
-    ]
-    
-    raw_data = fetch_census_by_state_loop(year, variables, "housing characteristics")
-    
+    nulls, to_int = ACS_NULLS, int
+    columns = acs_columns(HOUSING_CHARACTERISTICS_VARIABLES)
     result = {}
     for zip_code, row in raw_data.items():
+        total, _, occupied, vacant, _, owner, renter, year_built = columns(row)
         try:
             result[zip_code] = {
-                'totalHousingUnits': int(row[1]) if row[1] not in ['-666666666', 'null'] else None,
-                'occupiedUnits': int(row[3]) if row[3] not in ['-666666666', 'null'] else None,
-                'vacantUnits': int(row[4]) if row[4] not in ['-666666666', 'null'] else None,
-                'ownerOccupied': int(row[6]) if row[6] not in ['-666666666', 'null'] else None,
-                'renterOccupied': int(row[7]) if row[7] not in ['-666666666', 'null'] else None,
-                'medianYearBuilt': int(row[8]) if row[8] not in ['-666666666', 'null'] else None
+                'totalHousingUnits': to_int(total) if total not in nulls else None,
+                'occupiedUnits': to_int(occupied) if occupied not in nulls else None,
+                'vacantUnits': to_int(vacant) if vacant not in nulls else None,
+                'ownerOccupied': to_int(owner) if owner not in nulls else None,
+                'renterOccupied': to_int(renter) if renter not in nulls else None,
+                'medianYearBuilt': to_int(year_built) if year_built not in nulls else None
             }
         except: continue
     return result
 
-def fetch_housing_values_costs(year):
+def parse_housing_values_costs(raw_data):
     # Value, Rent, Owner Costs
-    variables = ['NAME', 'B25077_001E', 'B25064_001E', 'B25088_002E', 'B25088_003E']
-    
-    raw_data = fetch_census_by_state_loop(year, variables, "housing values")
-    
+    nulls, to_int = ACS_NULLS, int
+    columns = acs_columns(HOUSING_VALUES_VARIABLES)
     result = {}
     for zip_code, row in raw_data.items():
+        home_value, gross_rent, costs_mortgage, costs_no_mortgage = columns(row)
         try:
             result[zip_code] = {
-                'medianHomeValue': int(row[1]) if row[1] not in ['-666666666', 'null'] else None,
-                'medianGrossRent': int(row[2]) if row[2] not in ['-666666666', 'null'] else None,
-                'medianOwnerCostsWithMortgage': int(row[3]) if row[3] not in ['-666666666', 'null'] else None,
-                'medianOwnerCostsNoMortgage': int(row[4]) if row[4] not in ['-666666666', 'null'] else None
+                'medianHomeValue': to_int(home_value) if home_value not in nulls else None,
+                'medianGrossRent': to_int(gross_rent) if gross_rent not in nulls else None,
+                'medianOwnerCostsWithMortgage': to_int(costs_mortgage) if costs_mortgage not in nulls else None,
+                'medianOwnerCostsNoMortgage': to_int(costs_no_mortgage) if costs_no_mortgage not in nulls else None
             }
         except: continue
     return result
 
-def fetch_demographics(year):
+def parse_demographics(raw_data):
     # Pop, Age, Employment (B23025)
-    variables = [
-        'NAME', 'B01003_001E', 'B01002_001E',
-        'B23025_003E', 'B23025_004E', 'B23025_005E'
-    ]
-    
-    raw_data = fetch_census_by_state_loop(year, variables, "demographics")
-    
+    nulls, to_int, to_float, to_round = ACS_NULLS, int, float, round
+    columns = acs_columns(DEMOGRAPHICS_VARIABLES)
     result = {}
     for zip_code, row in raw_data.items():
+        population, median_age, civ_labor_force, employed, unemployed = columns(row)
         try:
-            civ_labor_force = int(row[3]) if row[3] not in ['-666666666', 'null', None] else 0
-            employed = int(row[4]) if row[4] not in ['-666666666', 'null', None] else 0
-            unemployed = int(row[5]) if row[5] not in ['-666666666', 'null', None] else 0
+            civ_labor_force = to_int(civ_labor_force) if civ_labor_force not in nulls else 0
+            employed = to_int(employed) if employed not in nulls else 0
+            unemployed = to_int(unemployed) if unemployed not in nulls else 0
             
             result[zip_code] = {
-                'totalPopulation': int(row[1]) if row[1] not in ['-666666666', 'null'] else None,
-                'medianAge': float(row[2]) if row[2] not in ['-666666666', 'null'] else None,
-                'employmentRate': round((employed / civ_labor_force) * 100, 1) if civ_labor_force > 0 else None,
-                'unemploymentRate': round((unemployed / civ_labor_force) * 100, 1) if civ_labor_force > 0 else None
+                'totalPopulation': to_int(population) if population not in nulls else None,
+                'medianAge': to_float(median_age) if median_age not in nulls else None,
+                'employmentRate': to_round((employed / civ_labor_force) * 100, 1) if civ_labor_force > 0 else None,
+                'unemploymentRate': to_round((unemployed / civ_labor_force) * 100, 1) if civ_labor_force > 0 else None
             }
         except: continue
     return result
 
 # ==================== MERGE AND SAVE ====================
 
+# Shared, never-mutated default for sources missing a ZCTA
+_EMPTY = {}
+
 def merge_all_data(household_econ, housing_chars, housing_vals, demographics, years_meta):
     print('Merging all data...')
     merged = {}
@@ -211,19 +232,20 @@ def merge_all_data(household_econ, housing_chars, housing_vals, demographics, ye
     all_zips = set(household_econ.keys()) | set(housing_chars.keys()) | set(housing_vals.keys())
     
     for zip_code in all_zips:
-        base_info = household_econ.get(zip_code, {})
+        base_info = household_econ.get(zip_code, _EMPTY)
         
-        merged[zip_code] = {
+        record = {
             'zipCode': zip_code,
             'name': base_info.get('name', f'ZCTA5 {zip_code}'),
             'medianHouseholdIncome': base_info.get('medianHouseholdIncome'),
-            'povertyRate': base_info.get('povertyRate'),
-            **housing_chars.get(zip_code, {}),
-            **housing_vals.get(zip_code, {}),
-            **demographics.get(zip_code, {}),
-            # Note: BEA GDP and HUD FMR not available for ZCTAs in this standard format
-            'years': years_meta
+            'povertyRate': base_info.get('povertyRate')
         }
+        for source in (housing_chars, housing_vals, demographics):
+            record.update(source.get(zip_code, _EMPTY))
+        # Note: BEA GDP and HUD FMR not available for ZCTAs in this standard format
+        record['years'] = years_meta
+        
+        merged[zip_code] = record
     
     return merged
 
@@ -244,37 +266,42 @@ def save_to_file(data, filename, years_meta):
         'data': data
     }
     
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    write_json_atomic(filepath, output)
     print(f'✓ Saved to: {filepath}')
 
 def main():
+    parser = argparse.ArgumentParser(description='Fetch Census ACS data for all US ZCTAs')
+    parser.add_argument('--no-cache', action='store_true', help='Clear the HTTP response cache before fetching')
+    args = parser.parse_args()
+    
     print('='*70)
     print('COMPLETE ZIP CODE (ZCTA) DATA FETCH (Census ACS)')
     print('='*70 + '\n')
     
+    if not CENSUS_API_KEY:
+        print('❌ Set the CENSUS_API_KEY environment variable first')
+        return
+    
     try:
+        if args.no_cache:
+            get_session().cache.clear()
+            print('✓ Cleared HTTP cache')
+        
         census_year = detect_latest_census_year()
         print(f'\n📅 Using: Census={census_year}\n')
         
         # Fetch Census data (Batched by State for robustness)
-        household_econ, he_year = fetch_with_year_fallback(fetch_household_economics, census_year)
-        time.sleep(1)
-        
-        housing_chars, hc_year = fetch_with_year_fallback(fetch_housing_characteristics, census_year)
-        time.sleep(1)
-        
-        housing_vals, hv_year = fetch_with_year_fallback(fetch_housing_values_costs, census_year)
-        time.sleep(1)
-        
-        demographics, d_year = fetch_with_year_fallback(fetch_demographics, census_year)
-        time.sleep(1)
+        acs, acs_year = fetch_with_year_fallback(fetch_acs_data, census_year)
+        household_econ = acs.get('householdEconomics', {})
+        housing_chars = acs.get('housingCharacteristics', {})
+        housing_vals = acs.get('housingValues', {})
+        demographics = acs.get('demographics', {})
         
         years_meta = {
-            'householdEconomics': he_year,
-            'housingCharacteristics': hc_year,
-            'housingValues': hv_year,
-            'demographics': d_year
+            'householdEconomics': acs_year,
+            'housingCharacteristics': acs_year,
+            'housingValues': acs_year,
+            'demographics': acs_year
         }
         
         merged = merge_all_data(household_econ, housing_chars, housing_vals, demographics, years_meta)